@@ -2,51 +2,97 @@
 FastAPI Backend for RAG Chatbot
 """
 import os
+import json
+import uuid
+import asyncio
+import logging
 from typing import List, Optional
 from fastapi import FastAPI, HTTPException, Body, Request, UploadFile, File
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from contextlib import asynccontextmanager
 
 # Import existing logic
 from app.core.loader import initialize_rag_system
-from app.core.chatbot import create_chatbot
+from app.core.chatbot import create_chatbot, create_semantic_cache, embed_question, has_history, close_clients, CONDENSE_QUESTION_TAG
+from app.core.log import start_queue_logging, stop_queue_logging
+from app.core.config import DOCUMENT_DIRECTORY, SERVER_WORKERS, KEEPALIVE_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # Global state
 app_state = {
     "vector_store": None,
-    "chain": None,
-    "initialized": False
+    "chains": None,
+    "cache": None,
+    "index_html": None,
+    "initialized": False,
+    # Serializes index builds so concurrent /initialize or /upload calls don't duplicate work
+    "init_lock": asyncio.Lock()
 }
 
+def _activate(vector_store):
+    """Build the per-session chains and semantic cache for a freshly loaded vector store."""
+    app_state["vector_store"] = vector_store
+    app_state["chains"] = create_chatbot(vector_store)
+    if app_state["cache"] is None:
+        app_state["cache"] = create_semantic_cache()
+    else:
+        # Answers from the previous index may be stale; the collection is kept for in-flight requests
+        app_state["cache"].clear()
+    app_state["initialized"] = True
+
+def _cacheable(chain, request) -> bool:
+    """
+    Only history-free questions mean the same thing every time they are asked,
+    so only those use the cache, shared across sessions.
+    """
+    return not request.chat_history and not has_history(chain)
+
+async def _build_and_activate(force_recreate: bool):
+    """Build the vector store in a worker thread so the event loop keeps serving requests."""
+    async with app_state["init_lock"]:
+        vector_store = await asyncio.to_thread(initialize_rag_system, force_recreate)
+        if vector_store:
+            _activate(vector_store)
+        return vector_store
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup logic: Try to initialize if vector store exists
+    start_queue_logging()
+    
+    # Startup logic: Serve the UI from memory instead of reading it on every request
+    index_file = os.path.join(static_dir, "index.html")
+    if os.path.exists(index_file):
+        with open(index_file, "rb") as f:
+            app_state["index_html"] = f.read()
+    
+    # Try to initialize if vector store exists
     try:
-        print("Starting up... Attempting to load existing vector store.")
+        logger.info("Starting up... Attempting to load existing vector store.")
         # We don't force recreate on startup to be faster
-        vector_store = initialize_rag_system(force_recreate=False)
+        vector_store = await _build_and_activate(force_recreate=False)
         if vector_store:
-            app_state["vector_store"] = vector_store
-            app_state["chain"] = create_chatbot(vector_store)
-            app_state["initialized"] = True
-            print("Startup initialization successful.")
+            logger.info("Startup initialization successful.")
         else:
-            print("No vector store found or created. System needs initialization.")
+            logger.info("No vector store found or created. System needs initialization.")
     except Exception as e:
-        print(f"Startup initialization failed (non-critical): {e}")
-        print("System will need explicit initialization via /initialize endpoint.")
+        logger.warning("Startup initialization failed (non-critical): %s", e)
+        logger.warning("System will need explicit initialization via /initialize endpoint.")
     
     yield
     
     # Shutdown logic
-    print("Shutting down...")
+    logger.info("Shutting down...")
+    await close_clients()
     app_state["vector_store"] = None
-    app_state["chain"] = None
+    app_state["chains"] = None
+    app_state["cache"] = None
     app_state["initialized"] = False
+    stop_queue_logging()
 
-app = FastAPI(title="Organization Specific Chatbot API", lifespan=lifespan)
+app = FastAPI(title="Organization Specific Chatbot API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Mount static files
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
@@ -61,6 +107,8 @@ class InitRequest(BaseModel):
 
 class ChatRequest(BaseModel):
     question: str
+    # Omitted ids get a fresh conversation; send back the returned id to continue it
+    session_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     chat_history: Optional[List] = None
 
 class SourceDocument(BaseModel):
@@ -72,18 +120,33 @@ class SourceDocument(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[SourceDocument]
+    session_id: str
 
 class HealthResponse(BaseModel):
     status: str
     initialized: bool
 
+def _format_sources(source_docs) -> List[dict]:
+    """Convert retrieved documents into response source entries (shaped like SourceDocument)."""
+    return [
+        {
+            "source": doc.metadata.get("source", "Unknown"),
+            "page_content": doc.page_content,
+            "page": doc.metadata.get("page"),
+            "type": doc.metadata.get("type", "unknown")
+        }
+        for doc in source_docs
+    ]
+
+def _sse(event: str, data) -> str:
+    """Encode one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve the chatbot UI."""
-    index_file = os.path.join(static_dir, "index.html")
-    if os.path.exists(index_file):
-        with open(index_file, "r", encoding="utf-8") as f:
-            return f.read()
+    if app_state["index_html"] is not None:
+        return HTMLResponse(app_state["index_html"])
     return {
         "message": "Welcome to the RAG Chatbot API! (UI index.html not found)",
         "documentation": "Go to /docs to interact with the API",
@@ -105,13 +168,10 @@ async def health_check():
 async def initialize_system(request: InitRequest = Body(...)):
     """Initialize or re-initialize the RAG system."""
     try:
-        vector_store = initialize_rag_system(force_recreate=request.force_recreate)
+        vector_store = await _build_and_activate(force_recreate=request.force_recreate)
         if not vector_store:
              raise Exception("Failed to create vector store. Check if documents exist in 'documents' folder.")
              
-        app_state["vector_store"] = vector_store
-        app_state["chain"] = create_chatbot(vector_store)
-        app_state["initialized"] = True
         return {"message": "System initialized successfully", "success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Initialization failed: {str(e)}")
@@ -133,18 +193,14 @@ async def upload_documents(files: List[UploadFile] = File(...)):
                 f.write(await file.read())
             saved_files.append(file.filename)
         except Exception as e:
-            print(f"Error saving {file.filename}: {e}")
+            logger.error("Error saving %s: %s", file.filename, e)
             
     if not saved_files:
         raise HTTPException(status_code=400, detail="No valid PDF or TXT files were uploaded")
         
-    # Re-initialize the system
+    # Re-initialize the system (only the new or changed files are embedded)
     try:
-        vector_store = initialize_rag_system(force_recreate=True)
-        if vector_store:
-            app_state["vector_store"] = vector_store
-            app_state["chain"] = create_chatbot(vector_store)
-            app_state["initialized"] = True
+        await _build_and_activate(force_recreate=False)
         return {
             "message": f"Successfully uploaded {len(saved_files)} files and re-initialized system.",
             "files": saved_files,
@@ -156,42 +212,126 @@ async def upload_documents(files: List[UploadFile] = File(...)):
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Ask a question to the chatbot."""
-    if not app_state["initialized"] or not app_state["chain"]:
+    if not app_state["initialized"] or not app_state["chains"]:
         raise HTTPException(
             status_code=400, 
             detail="System not initialized. Please call /initialize first."
         )
     
     try:
+        chain = app_state["chains"].get(request.session_id)
+        cache = app_state["cache"]
+        
+        # Serve near-duplicate questions straight from the semantic cache. Follow-ups skip it and
+        # are rephrased before retrieval, so only history-free turns embed the question up front;
+        # that one vector probes the cache and, on a miss, drives retrieval
+        cached = None
+        cacheable = _cacheable(chain, request)
+        if cacheable:
+            embedding = await embed_question(request.question)
+            cached = await cache.alookup(embedding)
+        if cached:
+            await chain.memory.asave_context({"question": request.question}, {"answer": cached["answer"]})
+            return ORJSONResponse({
+                "answer": cached["answer"],
+                "sources": cached["sources"],
+                "session_id": request.session_id
+            })
+        
         # Prepare inputs
         inputs = {"question": request.question}
         if request.chat_history:
             inputs["chat_history"] = request.chat_history
             
         # Get response
-        result = app_state["chain"].invoke(inputs)
+        result = await chain.ainvoke(inputs)
         
         # Process answer and sources
         answer = result["answer"]
         source_docs = result.get("source_documents", [])
         
-        formatted_sources = []
-        for doc in source_docs:
-            formatted_sources.append(SourceDocument(
-                source=doc.metadata.get("source", "Unknown"),
-                page_content=doc.page_content,
-                page=doc.metadata.get("page"),
-                type=doc.metadata.get("type", "unknown")
-            ))
-            
-        return {
+        formatted_sources = _format_sources(source_docs)
+        
+        if cacheable:
+            await cache.astore(request.question, embedding, answer, formatted_sources)
+        
+        # Returning a response directly skips re-validating it against ChatResponse (still used for the docs)
+        return ORJSONResponse({
             "answer": answer,
-            "sources": formatted_sources
-        }
+            "sources": formatted_sources,
+            "session_id": request.session_id
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Ask a question and stream the answer as server-sent events.
+    
+    Emits a `sources` event once documents are retrieved, then `token` events
+    as the answer is generated, and finally `done` carrying the session id (or `error`).
+    """
+    if not app_state["initialized"] or not app_state["chains"]:
+        raise HTTPException(
+            status_code=400, 
+            detail="System not initialized. Please call /initialize first."
+        )
+    
+    chain = app_state["chains"].get(request.session_id)
+    cache = app_state["cache"]
+    
+    async def event_stream():
+        try:
+            # Serve near-duplicate questions straight from the semantic cache. Follow-ups skip it and
+            # are rephrased before retrieval, so only history-free turns embed the question up front;
+            # that one vector probes the cache and, on a miss, drives retrieval
+            cached = None
+            cacheable = _cacheable(chain, request)
+            if cacheable:
+                embedding = await embed_question(request.question)
+                cached = await cache.alookup(embedding)
+            if cached:
+                await chain.memory.asave_context({"question": request.question}, {"answer": cached["answer"]})
+                yield _sse("sources", cached["sources"])
+                yield _sse("token", cached["answer"])
+                yield _sse("done", {"session_id": request.session_id})
+                return
+            
+            # Prepare inputs
+            inputs = {"question": request.question}
+            if request.chat_history:
+                inputs["chat_history"] = request.chat_history
+            
+            answer_parts = []
+            sources = []
+            async for event in chain.astream_events(inputs, version="v2"):
+                kind = event["event"]
+                if kind == "on_retriever_end":
+                    sources = _format_sources(event["data"]["output"])
+                    yield _sse("sources", sources)
+                elif kind == "on_chat_model_stream" and CONDENSE_QUESTION_TAG not in event.get("tags", []):
+                    token = event["data"]["chunk"].content
+                    if token:
+                        answer_parts.append(token)
+                        yield _sse("token", token)
+            
+            if cacheable:
+                await cache.astore(request.question, embedding, "".join(answer_parts), sources)
+            yield _sse("done", {"session_id": request.session_id})
+            
+        except Exception as e:
+            yield _sse("error", {"detail": f"Error generating response: {str(e)}"})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # An import string is required for multiple workers; uvloop/httptools are used when installed
+    uvicorn.run(
+        "app.api:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=SERVER_WORKERS,
+        timeout_keep_alive=KEEPALIVE_SECONDS
+    )
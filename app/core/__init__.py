@@ -0,0 +1,3 @@
+from app.core.log import configure_logging
+
+configure_logging()
@@ -1,17 +1,97 @@
 """
 RAG Chatbot Module
 """
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from contextvars import ContextVar
+import httpx
+import orjson
 import requests
-from typing import List, Optional, Any
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Optional, Any, AsyncIterator, ClassVar
+from pydantic import PrivateAttr
+from langchain.chains import ConversationalRetrievalChain, LLMChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering import load_qa_chain
+from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryBufferMemory
 from langchain.prompts import PromptTemplate
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import HumanMessage, AIMessage, ChatMessage
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, ChatMessage
+from langchain_core.callbacks.manager import (
+    CallbackManagerForLLMRun,
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForRetrieverRun,
+    AsyncCallbackManagerForRetrieverRun
+)
+from langchain_core.documents import Document
 from langchain_core.messages import BaseMessage as LangChainBaseMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.retrievers import BaseRetriever
 from langchain.schema import ChatGeneration, ChatResult
-from app.core.config import GROQ_API_KEY, GROQ_MODEL, RETRIEVER_K
+from langchain_chroma import Chroma
+from app.core.loader import get_embeddings
+from app.core.config import (
+    GROQ_API_KEY,
+    GROQ_MODEL,
+    RETRIEVER_K,
+    CHAT_HISTORY_WINDOW,
+    USE_SUMMARY_MEMORY,
+    SUMMARY_MAX_TOKENS,
+    CACHE_THRESHOLD,
+    CACHE_TTL_SECONDS,
+    CACHE_MAX_ENTRIES,
+    MAX_SESSIONS
+)
+
+
+def _create_session() -> requests.Session:
+    """Create a pooled HTTP session so connections to Groq are kept alive between calls."""
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json"
+    })
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset(["POST"])  # POST is not retried by default
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+def _create_async_client() -> httpx.AsyncClient:
+    """Create the pooled async HTTP client used by the async generation path."""
+    return httpx.AsyncClient(
+        headers={
+            "Authorization": f"Bearer {GROQ_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        timeout=60,
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    )
+
+
+_SESSION = _create_session()
+_ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Return the shared async client, creating it again if a previous shutdown closed it."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None or _ASYNC_CLIENT.is_closed:
+        _ASYNC_CLIENT = _create_async_client()
+    return _ASYNC_CLIENT
 
 
 class GroqChatModel(BaseChatModel):
@@ -22,6 +102,12 @@ class GroqChatModel(BaseChatModel):
     temperature: float = 0.7
     api_base: str = "https://api.groq.com/openai/v1"
     
+    # Shared across instances (and hot reloads) so the connection pool is reused
+    _session: ClassVar[requests.Session] = _SESSION
+    
+    # Payload fields that are the same for every call, built once per instance
+    _base_payload: dict = PrivateAttr(default_factory=dict)
+    
     def __init__(self, model_name: str = None, api_key: str = None, temperature: float = 0.7, **kwargs):
         # Initialize fields before calling super().__init__ or pass them in
         model_name = model_name or GROQ_MODEL
@@ -34,20 +120,14 @@ class GroqChatModel(BaseChatModel):
             temperature=temperature, 
             **kwargs
         )
+        self._base_payload = {"model": self.model_name, "temperature": self.temperature}
     
     @property
     def _llm_type(self) -> str:
         return "groq"
     
-    def _generate(
-        self,
-        messages: List[LangChainBaseMessage],
-        stop: Optional[List[str]] = None,
-        run_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ) -> ChatResult:
-        """Generate a response from Groq API."""
-        # Convert LangChain messages to OpenAI-compatible format
+    def _build_payload(self, messages: List[LangChainBaseMessage], stop: Optional[List[str]] = None, stream: bool = False) -> bytes:
+        """Convert LangChain messages into an encoded OpenAI-compatible request body."""
         formatted_messages = []
         for msg in messages:
             if isinstance(msg, HumanMessage):
@@ -59,41 +139,345 @@ class GroqChatModel(BaseChatModel):
             else:
                 formatted_messages.append({"role": "user", "content": str(msg.content)})
         
-        # Call Groq API
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": self.model_name,
-            "messages": formatted_messages,
-            "temperature": self.temperature
-        }
+        payload = {**self._base_payload, "messages": formatted_messages}
         
         if stop:
             payload["stop"] = stop
+        if stream:
+            payload["stream"] = True
+        
+        return orjson.dumps(payload)
+    
+    def _auth_headers(self) -> Optional[dict]:
+        """Only override the clients' auth header if a different key was passed in."""
+        if self.api_key != GROQ_API_KEY:
+            return {"Authorization": f"Bearer {self.api_key}"}
+        return None
+    
+    @staticmethod
+    def _to_chat_result(result: dict) -> ChatResult:
+        """Wrap a Groq completion response as a LangChain ChatResult."""
+        content = result["choices"][0]["message"]["content"]
+        
+        # Return LangChain message
+        message = AIMessage(content=content)
+        generation = ChatGeneration(message=message)
+        return ChatResult(generations=[generation])
+    
+    def _generate(
+        self,
+        messages: List[LangChainBaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Generate a response from Groq API."""
+        payload = self._build_payload(messages, stop)
         
-        response = requests.post(
+        # Call Groq API
+        response = self._session.post(
             f"{self.api_base}/chat/completions",
-            headers=headers,
-            json=payload,
+            headers=self._auth_headers(),
+            data=payload,
             timeout=60
         )
         
         if response.status_code != 200:
             raise ValueError(f"Groq API error: {response.status_code} - {response.text}")
         
-        result = response.json()
-        content = result["choices"][0]["message"]["content"]
+        return self._to_chat_result(orjson.loads(response.content))
+    
+    async def _agenerate(
+        self,
+        messages: List[LangChainBaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Generate a response from Groq API without blocking the event loop."""
+        payload = self._build_payload(messages, stop)
         
-        # Return LangChain message
-        message = AIMessage(content=content)
-        generation = ChatGeneration(message=message)
-        return ChatResult(generations=[generation])
+        # Concurrent calls share the pooled HTTP/2 connections
+        response = await _get_async_client().post(
+            f"{self.api_base}/chat/completions",
+            headers=self._auth_headers(),
+            content=payload
+        )
+        
+        if response.status_code != 200:
+            raise ValueError(f"Groq API error: {response.status_code} - {response.text}")
+        
+        return self._to_chat_result(orjson.loads(response.content))
+    
+    async def _astream(
+        self,
+        messages: List[LangChainBaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Stream response tokens from Groq API as they are generated."""
+        payload = self._build_payload(messages, stop, stream=True)
+        
+        async with _get_async_client().stream(
+            "POST",
+            f"{self.api_base}/chat/completions",
+            headers=self._auth_headers(),
+            content=payload
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise ValueError(f"Groq API error: {response.status_code} - {response.text}")
+            
+            # Server-sent events: one "data: {...}" line per chunk, ending with "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                
+                token = orjson.loads(data)["choices"][0]["delta"].get("content")
+                if not token:
+                    continue
+                
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    await run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
 
 
-def create_chatbot(vector_store, model_name: str = GROQ_MODEL):
+async def close_clients():
+    """Close the shared async HTTP client (call on application shutdown); the next call opens a new one."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
+
+
+# Tag on the question-rephrasing LLM so its output can be told apart from the answer when streaming
+CONDENSE_QUESTION_TAG = "condense_question"
+
+# (question, embedding) computed once per request, shared by the cache probe and the retriever
+_question_embedding: ContextVar[Optional[tuple]] = ContextVar("question_embedding", default=None)
+
+
+async def embed_question(question: str) -> List[float]:
+    """
+    Embed the user's question once for the current request.
+    
+    The retriever reuses this vector when it is asked for the same text, which is
+    the case whenever the question did not need rephrasing against chat history.
+    """
+    embedding = await get_embeddings().aembed_query(question)
+    _question_embedding.set((question, embedding))
+    return embedding
+
+
+def _reusable_embedding(query: str) -> Optional[List[float]]:
+    """Return the request's precomputed embedding if it was made for this query."""
+    current = _question_embedding.get()
+    if current is not None and current[0] == query:
+        return current[1]
+    return None
+
+
+class QuestionRetriever(BaseRetriever):
+    """Vector store retriever that skips re-embedding a question already embedded for this request."""
+    
+    vector_store: Any
+    k: int = RETRIEVER_K
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = _reusable_embedding(query)
+        if embedding is None:
+            return self.vector_store.similarity_search(query, k=self.k)
+        return self.vector_store.similarity_search_by_vector(embedding, k=self.k)
+    
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = _reusable_embedding(query)
+        if embedding is None:
+            return await self.vector_store.asimilarity_search(query, k=self.k)
+        return await self.vector_store.asimilarity_search_by_vector(embedding, k=self.k)
+
+
+class SemanticCache:
+    """
+    Cache of previous answers keyed by question embedding.
+    
+    A new question whose embedding is close enough to an already answered one
+    (cosine similarity >= threshold) reuses that answer instead of running
+    retrieval and the LLM again. Entries expire after ttl_seconds, and the oldest
+    are dropped once there are more than max_entries.
+    """
+    
+    collection_name = "semantic_cache"
+    
+    def __init__(self, embeddings, threshold: float = CACHE_THRESHOLD, ttl_seconds: int = CACHE_TTL_SECONDS,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # In-memory collection, emptied on creation so answers from a previous index are not served
+        self._store = Chroma(
+            collection_name=self.collection_name,
+            embedding_function=embeddings,
+            collection_metadata={"hnsw:space": "ip"}  # unit-norm embeddings: ip == cosine
+        )
+        self._store.reset_collection()
+    
+    def clear(self):
+        """Drop every cached answer, keeping the collection so in-flight requests can still use it."""
+        ids = self._store.get(include=[])["ids"]
+        if ids:
+            self._store.delete(ids=ids)
+    
+    async def alookup(self, embedding: List[float], namespace: str = "default") -> Optional[dict]:
+        """Return the cached answer and sources for a similar question embedding, or None on a miss."""
+        where = {"$and": [
+            {"namespace": namespace},
+            {"created_at": {"$gte": time.time() - self.ttl_seconds}}
+        ]}
+        hits = await asyncio.to_thread(
+            self._store.similarity_search_by_vector_with_relevance_scores, embedding, k=1, filter=where
+        )
+        if not hits:
+            return None
+        
+        # Chroma's ip distance is 1 - dot product, so recover the similarity directly
+        doc, distance = hits[0]
+        if 1.0 - distance < self.threshold:
+            return None
+        
+        return {
+            "answer": doc.metadata["answer"],
+            "sources": json.loads(doc.metadata["sources"])
+        }
+    
+    async def astore(self, question: str, embedding: List[float], answer: str, sources: List[dict], namespace: str = "default"):
+        """Remember the answer given to a question, reusing its already computed embedding."""
+        await asyncio.to_thread(self._store_and_prune, question, embedding, answer, sources, namespace)
+    
+    def _store_and_prune(self, question: str, embedding: List[float], answer: str, sources: List[dict], namespace: str):
+        collection = self._store._collection
+        now = time.time()
+        collection.add(
+            ids=[str(uuid.uuid4())],
+            embeddings=[embedding],
+            documents=[question],
+            metadatas=[{
+                "answer": answer,
+                "sources": json.dumps(sources),
+                "namespace": namespace,
+                "created_at": now
+            }]
+        )
+        
+        # Expired entries are never served, so drop them instead of letting the collection grow
+        collection.delete(where={"created_at": {"$lt": now - self.ttl_seconds}})
+        
+        excess = collection.count() - self.max_entries
+        if excess > 0:
+            entries = collection.get(include=["metadatas"])
+            oldest = sorted(zip(entries["ids"], entries["metadatas"]), key=lambda entry: entry[1]["created_at"])
+            collection.delete(ids=[entry_id for entry_id, _ in oldest[:excess]])
+
+
+def has_history(chain) -> bool:
+    """Check whether a session's memory already holds earlier turns."""
+    memory = chain.memory
+    return bool(memory.chat_memory.messages) or bool(getattr(memory, "moving_summary_buffer", ""))
+
+
+def create_semantic_cache() -> SemanticCache:
+    """
+    Create a semantic cache that shares the document store's embedding model.
+    
+    Returns:
+        SemanticCache instance
+    """
+    return SemanticCache(get_embeddings())
+
+
+class WindowMemory(ConversationBufferWindowMemory):
+    """
+    Window memory that also forgets turns outside the window.
+    
+    ConversationBufferWindowMemory only limits what goes into the prompt and
+    keeps every message; trimming after each save bounds what a session holds.
+    """
+    
+    def _trim(self):
+        excess = len(self.chat_memory.messages) - 2 * self.k
+        if excess > 0:
+            del self.chat_memory.messages[:excess]
+    
+    def save_context(self, inputs: dict, outputs: dict) -> None:
+        super().save_context(inputs, outputs)
+        self._trim()
+    
+    async def asave_context(self, inputs: dict, outputs: dict) -> None:
+        await super().asave_context(inputs, outputs)
+        self._trim()
+
+
+class SessionChains:
+    """
+    Conversational chains keyed by session id.
+    
+    The LLMs, retriever and prompt chains are built once and shared; each session
+    only gets its own memory, so users never see each other's history. The least
+    recently used session is dropped once max_sessions is reached.
+    """
+    
+    def __init__(self, llm, condense_llm, retriever, prompt: PromptTemplate, max_sessions: int = MAX_SESSIONS):
+        self.condense_llm = condense_llm
+        self.retriever = retriever
+        self.max_sessions = max_sessions
+        self.combine_docs_chain = load_qa_chain(llm, chain_type="stuff", prompt=prompt, verbose=False)
+        self.question_generator = LLMChain(llm=condense_llm, prompt=CONDENSE_QUESTION_PROMPT, verbose=False)
+        self._chains: OrderedDict = OrderedDict()
+    
+    def _create_memory(self):
+        """Create bounded memory for conversation history so prompts don't grow without limit."""
+        if USE_SUMMARY_MEMORY:
+            # Older turns are summarized by the condense LLM, whose output is never streamed
+            return ConversationSummaryBufferMemory(
+                llm=self.condense_llm,
+                max_token_limit=SUMMARY_MAX_TOKENS,
+                memory_key="chat_history",
+                return_messages=True,
+                output_key="answer"
+            )
+        return WindowMemory(
+            k=CHAT_HISTORY_WINDOW,
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer"
+        )
+    
+    def get(self, session_id: str) -> ConversationalRetrievalChain:
+        """Return the chain for a session, creating it on first use."""
+        chain = self._chains.get(session_id)
+        if chain is not None:
+            self._chains.move_to_end(session_id)
+            return chain
+        
+        chain = ConversationalRetrievalChain(
+            retriever=self.retriever,
+            combine_docs_chain=self.combine_docs_chain,
+            question_generator=self.question_generator,
+            memory=self._create_memory(),
+            return_source_documents=True,
+            verbose=False
+        )
+        self._chains[session_id] = chain
+        if len(self._chains) > self.max_sessions:
+            self._chains.popitem(last=False)
+        return chain
+
+
+def create_chatbot(vector_store, model_name: str = GROQ_MODEL) -> SessionChains:
     """
     Create a conversational chatbot with RAG capabilities using Groq (FREE online API).
     
@@ -102,7 +486,7 @@ def create_chatbot(vector_store, model_name: str = GROQ_MODEL):
         model_name: Name of the Groq model to use
         
     Returns:
-        ConversationalRetrievalChain instance
+        SessionChains handing out a ConversationalRetrievalChain per session
     """
     if not GROQ_API_KEY:
         raise ValueError("GROQ_API_KEY not found. Please set it in your .env file. Get a free key from https://console.groq.com/")
@@ -114,11 +498,17 @@ def create_chatbot(vector_store, model_name: str = GROQ_MODEL):
         temperature=0.7
     )
     
-    # Create a retriever from the vector store
-    retriever = vector_store.as_retriever(
-        search_kwargs={"k": RETRIEVER_K}
+    # Separate instance for rephrasing follow-up questions, tagged so streams can skip it
+    condense_llm = GroqChatModel(
+        model_name=model_name,
+        api_key=GROQ_API_KEY,
+        temperature=0.7,
+        tags=[CONDENSE_QUESTION_TAG]
     )
     
+    # Create a retriever from the vector store that reuses the request's question embedding
+    retriever = QuestionRetriever(vector_store=vector_store, k=RETRIEVER_K)
+    
     # Custom prompt template for better responses
     custom_prompt = PromptTemplate(
         input_variables=["chat_history", "question", "context"],
@@ -137,24 +527,7 @@ Please provide a helpful and accurate answer based on the context. If the answer
 Answer:"""
     )
     
-    # Create memory for conversation history
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key="answer"
-    )
-    
-    # Create the conversational retrieval chain
-    chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=retriever,
-        memory=memory,
-        combine_docs_chain_kwargs={"prompt": custom_prompt},
-        return_source_documents=True,
-        verbose=False
-    )
-    
-    return chain
+    return SessionChains(llm, condense_llm, retriever, custom_prompt)
 
 
 def chat(chain, question: str, chat_history: list = None):
@@ -15,11 +15,47 @@ load_dotenv(os.path.join(ROOT_DIR, ".env"))
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = "llama-3.3-70b-versatile"
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# "onnx" runs the embedder on ONNX Runtime (falls back to "torch" if it isn't installed)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+# Prebuilt ONNX exports shipped with EMBEDDING_MODEL: FP16 for CUDA, dynamic-INT8 per CPU instruction set
+ONNX_MODEL_FILES = {
+    "cuda": "onnx/model_O4.onnx",
+    "avx512_vnni": "onnx/model_qint8_avx512_vnni.onnx",
+    "avx2": "onnx/model_quint8_avx2.onnx",
+    "arm64": "onnx/model_qint8_arm64.onnx",
+}
+# Overrides the CPU export picked for the host
+ONNX_CPU_MODEL_FILE = os.getenv("ONNX_CPU_MODEL_FILE")
 
 # Directory paths
 DOCUMENT_DIRECTORY = os.path.join(ROOT_DIR, "documents")
 VECTOR_STORE_DIRECTORY = os.path.join(ROOT_DIR, "vector_store")
+# "faiss" (in-process exact inner-product index) or "chroma"
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "faiss")
 
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+# Chunk sizes are in embedding-model tokens; 250 stays under MiniLM's 256 limit with [CLS]/[SEP]
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 50
 RETRIEVER_K = 3
+
+# PDFs are parsed in a process pool only when there is enough to amortize starting it
+PDF_MAX_WORKERS = 4
+PDF_POOL_MIN_BYTES = 16 * 1024 * 1024
+
+# Conversation memory: keep the last N exchanges, or summarize older turns when enabled
+CHAT_HISTORY_WINDOW = 6
+USE_SUMMARY_MEMORY = False
+SUMMARY_MAX_TOKENS = 1500
+
+# Per-session chains: least recently used sessions are dropped beyond this many
+MAX_SESSIONS = 1024
+
+# Semantic cache: answers are reused for questions at least this similar (cosine)
+CACHE_THRESHOLD = 0.92
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 2048
+
+# Server processes. Chat sessions, the semantic cache and the index live in each
+# worker's memory, so more than one worker needs a sticky load balancer in front.
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+KEEPALIVE_SECONDS = 30
@@ -2,76 +2,224 @@
 Document Loader and Processing Module
 """
 import os
+import json
+import logging
+import uuid
+import hashlib
+import itertools
+import platform
+import multiprocessing
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from filelock import FileLock
+from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from app.core.pdf_loader import load_pdf
 from app.core.config import (
     DOCUMENT_DIRECTORY,
     VECTOR_STORE_DIRECTORY,
+    VECTOR_STORE_BACKEND,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
-    EMBEDDING_MODEL
+    PDF_MAX_WORKERS,
+    PDF_POOL_MIN_BYTES,
+    EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    ONNX_MODEL_FILES,
+    ONNX_CPU_MODEL_FILE
 )
 
+logger = logging.getLogger(__name__)
 
-def load_documents(doc_directory: str = DOCUMENT_DIRECTORY) -> list:
+_embeddings_singleton = None
+_tokenizer_singleton = None
+
+
+def _select_device() -> str:
+    """Pick the fastest available torch device for the embedding model."""
+    import torch
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def _onnx_cpu_model_file() -> str:
+    """Pick the INT8 ONNX export built for the host CPU's instruction set."""
+    if ONNX_CPU_MODEL_FILE:
+        return ONNX_CPU_MODEL_FILE
+    if platform.machine().lower() in ('arm64', 'aarch64'):
+        return ONNX_MODEL_FILES['arm64']
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        flags = ''
+    if 'avx512_vnni' in flags:
+        return ONNX_MODEL_FILES['avx512_vnni']
+    # Any x86-64 CPU this code is likely to run on has AVX2
+    return ONNX_MODEL_FILES['avx2']
+
+
+def _model_kwargs(device: str) -> dict:
+    """Build SentenceTransformer kwargs, using a quantized ONNX Runtime model when possible."""
+    if EMBEDDING_BACKEND != 'onnx' or device not in ('cpu', 'cuda'):
+        return {'device': device}
+    if importlib.util.find_spec('onnxruntime') is None or importlib.util.find_spec('optimum') is None:
+        logger.warning("ONNX Runtime not installed, falling back to torch embeddings.")
+        return {'device': device}
+    
+    if device == 'cuda':
+        import onnxruntime
+        # The plain onnxruntime package only ships the CPU provider
+        if 'CUDAExecutionProvider' not in onnxruntime.get_available_providers():
+            logger.warning("ONNX Runtime has no CUDA support, falling back to torch embeddings.")
+            return {'device': device}
+        file_name, provider = ONNX_MODEL_FILES['cuda'], 'CUDAExecutionProvider'
+    else:
+        file_name, provider = _onnx_cpu_model_file(), 'CPUExecutionProvider'
+    return {
+        'device': device,
+        'backend': 'onnx',
+        'model_kwargs': {'file_name': file_name, 'provider': provider}
+    }
+
+
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """
+    Get the shared embedding model, loading it on first use.
+    
+    Embeddings are L2-normalized, so every stored and query vector is unit-norm
+    and inner-product search gives cosine similarity.
+    
+    Returns:
+        HuggingFaceEmbeddings instance reused by the vector store and semantic cache
+    """
+    global _embeddings_singleton
+    if _embeddings_singleton is None:
+        # Use local HuggingFace embeddings (no API key needed)
+        device = _select_device()
+        model_kwargs = _model_kwargs(device)
+        backend = model_kwargs.get('backend', 'torch')
+        logger.info("Loading embedding model: %s (device: %s, backend: %s)", EMBEDDING_MODEL, device, backend)
+        _embeddings_singleton = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs=model_kwargs,
+            # Chroma hands all chunks to embed_documents at once, so this sets the forward-pass size
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': 128}
+        )
+    return _embeddings_singleton
+
+
+def get_tokenizer():
     """
-    Load all PDF and TXT files from the specified directory.
+    Get the embedding model's tokenizer, loading it on first use.
+    
+    Returns:
+        Hugging Face fast tokenizer for EMBEDDING_MODEL
+    """
+    global _tokenizer_singleton
+    if _tokenizer_singleton is None:
+        from transformers import AutoTokenizer
+        _tokenizer_singleton = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    return _tokenizer_singleton
+
+
+def _load_txt(path: str) -> list:
+    """Load a single TXT file; runs in a worker thread."""
+    name = os.path.basename(path)
+    try:
+        logger.info("Loading: %s", name)
+        documents = TextLoader(path, encoding='utf-8').load()
+        # Add metadata
+        for doc in documents:
+            doc.metadata['source'] = name
+            doc.metadata['type'] = 'txt'
+        return documents
+    except Exception as e:
+        logger.error("Error loading %s: %s", name, e)
+        return []
+
+
+def hash_documents(doc_directory: str = DOCUMENT_DIRECTORY) -> dict:
+    """
+    Compute the content hash of every PDF and TXT file in the specified directory.
     
     Args:
         doc_directory: Path to directory containing document files
         
     Returns:
-        List of Document objects from all files
+        Dictionary mapping file path to its SHA-256 hex digest
     """
     doc_path = Path(doc_directory)
     if not doc_path.exists():
         os.makedirs(doc_path, exist_ok=True)
-        print(f"Created document directory at: {doc_path}")
-        return []
+        logger.info("Created document directory at: %s", doc_path)
+        return {}
+    
+    files = sorted(doc_path.glob("*.pdf")) + sorted(doc_path.glob("*.txt"))
+    return {str(p): hashlib.sha256(p.read_bytes()).hexdigest() for p in files}
+
+
+def load_documents(doc_directory: str = DOCUMENT_DIRECTORY, file_hashes: dict = None) -> list:
+    """
+    Load PDF and TXT files from the specified directory.
+    
+    Args:
+        doc_directory: Path to directory containing document files
+        file_hashes: Files to load mapped to their content hash (defaults to every file in doc_directory)
+        
+    Returns:
+        List of Document objects from all files, tagged with their file's hash
+    """
+    if file_hashes is None:
+        file_hashes = hash_documents(doc_directory)
         
     all_documents = []
     
-    # Load PDFs
-    pdf_files = list(doc_path.glob("*.pdf"))
+    # Load PDFs (CPU-bound parsing, so spread across processes)
+    pdf_files = [p for p in file_hashes if p.endswith(".pdf")]
     if pdf_files:
-        print(f"Found {len(pdf_files)} PDF file(s).")
-        for pdf_file in pdf_files:
-            try:
-                print(f"Loading: {pdf_file.name}")
-                loader = PyPDFLoader(str(pdf_file))
-                documents = loader.load()
-                # Add metadata
-                for doc in documents:
-                    doc.metadata['source'] = pdf_file.name
-                    doc.metadata['type'] = 'pdf'
-                all_documents.extend(documents)
-            except Exception as e:
-                print(f"Error loading {pdf_file.name}: {e}")
+        logger.info("Found %d PDF file(s).", len(pdf_files))
+        workers = min(len(pdf_files), os.cpu_count() or 1, PDF_MAX_WORKERS)
+        total_bytes = sum(os.path.getsize(path) for path in pdf_files)
+        if workers > 1 and total_bytes >= PDF_POOL_MIN_BYTES:
+            # Spawned, not forked: this runs on a worker thread, and forking a threaded process is unsafe
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(load_pdf, pdf_files))
+        else:
+            # Starting interpreters costs more than parsing a few small files here
+            results = [load_pdf(path) for path in pdf_files]
+        for path, (documents, error) in zip(pdf_files, results):
+            if error:
+                logger.error("Error loading %s: %s", os.path.basename(path), error)
+                continue
+            logger.info("Loaded: %s", os.path.basename(path))
+            for doc in documents:
+                doc.metadata['file_hash'] = file_hashes[path]
+            all_documents.extend(documents)
 
-    # Load TXTs
-    txt_files = list(doc_path.glob("*.txt"))
+    # Load TXTs (I/O-bound, threads are enough)
+    txt_files = [p for p in file_hashes if p.endswith(".txt")]
     if txt_files:
-        print(f"Found {len(txt_files)} TXT file(s).")
-        for txt_file in txt_files:
-            try:
-                print(f"Loading: {txt_file.name}")
-                loader = TextLoader(str(txt_file), encoding='utf-8')
-                documents = loader.load()
-                # Add metadata
+        logger.info("Found %d TXT file(s).", len(txt_files))
+        workers = min(len(txt_files), 8)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, documents in zip(txt_files, executor.map(_load_txt, txt_files)):
                 for doc in documents:
-                    doc.metadata['source'] = txt_file.name
-                    doc.metadata['type'] = 'txt'
+                    doc.metadata['file_hash'] = file_hashes[path]
                 all_documents.extend(documents)
-            except Exception as e:
-                print(f"Error loading {txt_file.name}: {e}")
     
     if not all_documents:
-        print(f"No documents found in '{doc_directory}'.")
+        logger.info("No documents found in '%s'.", doc_directory)
     else:
-        print(f"Successfully loaded {len(all_documents)} chunks/pages.")
+        logger.info("Successfully loaded %d chunks/pages.", len(all_documents))
         
     return all_documents
 
@@ -80,25 +228,44 @@ def split_documents(documents: list, chunk_size: int = CHUNK_SIZE, chunk_overlap
     """
     Split documents into smaller chunks for better retrieval.
     
+    Chunk lengths are measured in embedding-model tokens, so chunks fill the
+    model's input window instead of being cut at an arbitrary character count.
+    
     Args:
         documents: List of Document objects
-        chunk_size: Size of each chunk
-        chunk_overlap: Overlap between chunks
+        chunk_size: Size of each chunk (in tokens)
+        chunk_overlap: Overlap between chunks (in tokens)
         
     Returns:
         List of split Document chunks
     """
-    text_splitter = RecursiveCharacterTextSplitter(
+    if not documents:
+        return []
+    
+    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        get_tokenizer(),
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=len,
     )
-    chunks = text_splitter.split_documents(documents)
-    print(f"Split documents into {len(chunks)} chunks.")
+    
+    # The Rust tokenizer releases the GIL, so documents can be split on threads
+    workers = min(len(documents), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = list(itertools.chain.from_iterable(
+            executor.map(text_splitter.split_documents, [[doc] for doc in documents])
+        ))
+    logger.info("Split documents into %d chunks.", len(chunks))
     return chunks
 
 
-def create_vector_store(chunks: list, persist_directory: str = VECTOR_STORE_DIRECTORY, force_recreate: bool = False):
+def _vector_store_exists(persist_directory: str) -> bool:
+    """Check whether an index for the configured backend has been persisted."""
+    if VECTOR_STORE_BACKEND == 'faiss':
+        return os.path.exists(os.path.join(persist_directory, "index.faiss"))
+    return os.path.exists(persist_directory)
+
+
+def create_vector_store(chunks: list, persist_directory: str = VECTOR_STORE_DIRECTORY, force_recreate: bool = False, ids: list = None):
     """
     Create or load a vector store from document chunks.
     
@@ -106,72 +273,181 @@ def create_vector_store(chunks: list, persist_directory: str = VECTOR_STORE_DIRE
         chunks: List of document chunks
         persist_directory: Directory to persist the vector store
         force_recreate: If True, recreate the vector store even if it exists
+        ids: Optional IDs for the chunks, used to delete them later
         
     Returns:
-        Chroma vector store
+        FAISS or Chroma vector store, depending on VECTOR_STORE_BACKEND
     """
-    # Use local HuggingFace embeddings (no API key needed)
-    print(f"Loading embedding model: {EMBEDDING_MODEL}")
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': 'cpu'}  # Use 'cuda' if you have GPU
-    )
+    embeddings = get_embeddings()
     
     # Check if vector store already exists
-    if os.path.exists(persist_directory) and not force_recreate:
-        print(f"Loading existing vector store from {persist_directory}...")
-        vector_store = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=embeddings
-        )
-        print("Vector store loaded successfully.")
+    if _vector_store_exists(persist_directory) and not force_recreate:
+        logger.info("Loading existing vector store from %s...", persist_directory)
+        if VECTOR_STORE_BACKEND == 'faiss':
+            # The docstore is pickled by save_local; it is only ever read from our own directory
+            vector_store = FAISS.load_local(
+                persist_directory,
+                embeddings,
+                allow_dangerous_deserialization=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+        else:
+            vector_store = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=embeddings
+            )
+        logger.info("Vector store loaded successfully.")
     else:
         if force_recreate and os.path.exists(persist_directory):
             import shutil
             shutil.rmtree(persist_directory)
-            print("Removed existing vector store.")
+            logger.info("Removed existing vector store.")
         
         if not chunks:
-             print("No chunks to index. Returning empty initialized store if possible, or None.")
+             logger.info("No chunks to index. Returning empty initialized store if possible, or None.")
              # Create empty store if possible or handle gracefully
-             # Chroma requires documents to initialize if not loading from disk
-             if not os.path.exists(persist_directory):
+             # Neither backend can build an index without documents
+             if VECTOR_STORE_BACKEND == 'faiss' or not os.path.exists(persist_directory):
                  return None 
 
-        print("Creating new vector store...")
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=persist_directory
-        )
-        print(f"Vector store created and persisted to {persist_directory}.")
+        logger.info("Creating new vector store...")
+        if VECTOR_STORE_BACKEND == 'faiss':
+            # Embeddings are unit-norm, so inner product equals cosine similarity
+            vector_store = FAISS.from_documents(
+                chunks,
+                embeddings,
+                ids=ids,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+            vector_store.save_local(persist_directory)
+        else:
+            vector_store = Chroma.from_documents(
+                documents=chunks,
+                embedding=embeddings,
+                ids=ids,
+                persist_directory=persist_directory,
+                # Embeddings are unit-norm, so inner product equals cosine similarity
+                collection_metadata={"hnsw:space": "ip"}
+            )
+        logger.info("Vector store created and persisted to %s.", persist_directory)
     
     return vector_store
 
 
-def initialize_rag_system(force_recreate: bool = False):
+def _manifest_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, "manifest.json")
+
+
+def _read_manifest(persist_directory: str):
+    """Read the file -> {hash, chunk IDs} manifest of an index, or None if there is no usable one."""
+    try:
+        with open(_manifest_path(persist_directory), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # An index written by another backend or embedding model (or an older manifest format) can't be updated in place
+    if (not isinstance(manifest.get("files"), dict)
+            or manifest.get("backend") != VECTOR_STORE_BACKEND
+            or manifest.get("embedding_model") != EMBEDDING_MODEL):
+        return None
+    return manifest["files"]
+
+
+def _write_manifest(persist_directory: str, files: dict):
+    os.makedirs(persist_directory, exist_ok=True)
+    manifest = {"backend": VECTOR_STORE_BACKEND, "embedding_model": EMBEDDING_MODEL, "files": files}
+    with open(_manifest_path(persist_directory), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+
+def _chunk_ids(chunks: list) -> tuple:
+    """Give every chunk an ID and group the IDs by the file (and file content) they came from."""
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    manifest = {}
+    for chunk_id, chunk in zip(ids, chunks):
+        entry = manifest.setdefault(chunk.metadata['source'], {"hash": chunk.metadata['file_hash'], "ids": []})
+        entry["ids"].append(chunk_id)
+    return ids, manifest
+
+
+def initialize_rag_system(force_recreate: bool = False, persist_directory: str = VECTOR_STORE_DIRECTORY):
     """
     Initialize the complete RAG system: load docs, split, and create vector store.
     
+    An existing index is updated incrementally: only files that are new or whose
+    content hash differs from the manifest are loaded and embedded, and chunks of
+    files that were removed or changed are deleted. A file lock next to the index
+    lets only one server worker process build or update it at a time.
+    
     Args:
         force_recreate: If True, recreate the vector store even if it exists
+        persist_directory: Directory to persist the vector store
         
     Returns:
-        Chroma vector store ready for retrieval
+        Vector store ready for retrieval
     """
-    # Load Documents
-    documents = load_documents()
+    # The lock lives beside the directory, which a rebuild deletes
+    with FileLock(os.path.normpath(persist_directory) + ".lock"):
+        return _sync_index(force_recreate, persist_directory)
+
+
+def _rebuild_index(file_hashes: dict, persist_directory: str):
+    """Index every document from scratch and record it in a new manifest."""
+    documents = load_documents(file_hashes=file_hashes)
+    chunks = split_documents(documents)
+    ids, manifest = _chunk_ids(chunks)
+    vector_store = create_vector_store(chunks, persist_directory=persist_directory, force_recreate=True, ids=ids)
+    if vector_store:
+        _write_manifest(persist_directory, manifest)
+    return vector_store
+
+
+def _sync_index(force_recreate: bool, persist_directory: str):
+    """Bring the index in line with the documents directory; caller holds the index lock."""
+    file_hashes = hash_documents()
     
-    if not documents and force_recreate:
-        print("No documents found to index.")
+    if not file_hashes and force_recreate:
+        logger.info("No documents found to index.")
         return None
-
-    # Split documents
-    chunks = []
-    if documents:
+    
+    manifest = None if force_recreate else _read_manifest(persist_directory)
+    vector_store = None
+    if manifest is not None:
+        vector_store = create_vector_store([], persist_directory=persist_directory)
+    
+    if vector_store is None:
+        # Nothing indexed yet (or no record of what was)
+        return _rebuild_index(file_hashes, persist_directory)
+    
+    # Drop chunks of files that are gone or whose content changed
+    current = {os.path.basename(path): h for path, h in file_hashes.items()}
+    stale = [name for name, entry in manifest.items() if current.get(name) != entry["hash"]]
+    if stale:
+        try:
+            vector_store.delete(ids=[chunk_id for name in stale for chunk_id in manifest.pop(name)["ids"]])
+        except ValueError as e:
+            # FAISS refuses unknown IDs, which means the index and manifest have drifted apart
+            logger.warning("Index does not match its manifest (%s); rebuilding.", e)
+            return _rebuild_index(file_hashes, persist_directory)
+        logger.info("Removed %d outdated document(s) from the index.", len(stale))
+    
+    # Embed only files that are not indexed (in their current version) yet
+    new_files = {path: h for path, h in file_hashes.items() if os.path.basename(path) not in manifest}
+    if new_files:
+        documents = load_documents(file_hashes=new_files)
         chunks = split_documents(documents)
+        if chunks:
+            ids, added = _chunk_ids(chunks)
+            vector_store.add_documents(chunks, ids=ids)
+            manifest.update(added)
+            logger.info("Indexed %d new chunks.", len(chunks))
     
-    # Create vector store
-    vector_store = create_vector_store(chunks, force_recreate=force_recreate)
+    if stale or new_files:
+        # Chroma persists on write; FAISS has to be saved explicitly
+        if VECTOR_STORE_BACKEND == 'faiss':
+            vector_store.save_local(persist_directory)
+        _write_manifest(persist_directory, manifest)
+    else:
+        logger.info("Index is up to date.")
     
     return vector_store
@@ -0,0 +1,52 @@
+"""
+Logging Setup Module
+"""
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+from typing import Optional
+
+_app_logger = logging.getLogger("app")
+_listener: Optional[QueueListener] = None
+_previous_handlers: list = []
+
+
+def _stream_handler() -> logging.Handler:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    return handler
+
+
+def configure_logging():
+    """Write the app's INFO messages straight to stderr unless logging is already set up."""
+    if not _app_logger.handlers:
+        _app_logger.addHandler(_stream_handler())
+        _app_logger.setLevel(logging.INFO)
+        _app_logger.propagate = False
+
+
+def start_queue_logging():
+    """
+    Route the app's log records through a queue drained by a background thread
+    (call on application startup).
+    
+    Request handlers only enqueue records, so they never wait on writes to stderr.
+    """
+    global _listener, _previous_handlers
+    if _listener is not None:
+        return
+    _listener = QueueListener(Queue(-1), _stream_handler())
+    _previous_handlers = _app_logger.handlers
+    _app_logger.handlers = [QueueHandler(_listener.queue)]
+    _listener.start()
+
+
+def stop_queue_logging():
+    """Flush queued records and restore direct logging (call on application shutdown)."""
+    global _listener, _previous_handlers
+    if _listener is None:
+        return
+    _listener.stop()
+    _app_logger.handlers = _previous_handlers
+    _listener = None
+    _previous_handlers = []
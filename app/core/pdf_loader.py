@@ -0,0 +1,27 @@
+"""
+PDF Loading Module
+
+Kept free of heavy imports: the loader's process pool starts fresh interpreters
+that only need to import this module to parse PDFs.
+"""
+import os
+from langchain_community.document_loaders import PyPDFLoader
+
+
+def load_pdf(path: str) -> tuple:
+    """
+    Load a single PDF file; runs in a worker process when loading several.
+    
+    Worker processes don't share the parent's log handlers, so errors are
+    returned alongside the documents for the parent to log.
+    """
+    name = os.path.basename(path)
+    try:
+        documents = PyPDFLoader(path).load()
+        # Add metadata
+        for doc in documents:
+            doc.metadata['source'] = name
+            doc.metadata['type'] = 'pdf'
+        return documents, None
+    except Exception as e:
+        return [], str(e)
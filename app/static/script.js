@@ -11,6 +11,8 @@ const loaderText = document.getElementById('loader-text');
 
 // State
 let isProcessing = false;
+// Identifies this page's conversation so the server keeps its history separate
+const sessionId = Date.now().toString(36) + Math.random().toString(36).slice(2);
 
 // Check API health on load
 async function checkHealth() {
@@ -35,28 +37,44 @@ async function checkHealth() {
     }
 }
 
+// Build the sources footer for a bot message
+function sourcesHtml(sources) {
+    if (!sources || sources.length === 0) return '';
+
+    let content = `<div class="sources-container"><strong>Sources:</strong> `;
+    const uniqueSources = [...new Set(sources.map(s => s.source))];
+    uniqueSources.forEach(source => {
+        const fileName = source.split(/[\\/]/).pop();
+        content += `<span class="source-tag">${fileName}</span>`;
+    });
+    content += `</div>`;
+    return content;
+}
+
 // Add a message to the UI
 function addMessage(text, role, sources = []) {
     const msgDiv = document.createElement('div');
     msgDiv.className = `msg ${role}`;
 
     let content = `<div class="msg-bubble"><p>${text}</p>`;
-
-    if (sources && sources.length > 0) {
-        content += `<div class="sources-container"><strong>Sources:</strong> `;
-        const uniqueSources = [...new Set(sources.map(s => s.source))];
-        uniqueSources.forEach(source => {
-            const fileName = source.split(/[\\/]/).pop();
-            content += `<span class="source-tag">${fileName}</span>`;
-        });
-        content += `</div>`;
-    }
-
+    content += sourcesHtml(sources);
     content += `</div>`;
     msgDiv.innerHTML = content;
 
     chatMessages.appendChild(msgDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return msgDiv;
+}
+
+// Parse one server-sent event block into its event name and JSON data
+function parseEvent(block) {
+    let event = 'message';
+    let data = '';
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+    });
+    return { event, data: data ? JSON.parse(data) : null };
 }
 
 // Handle chat submission
@@ -74,22 +92,58 @@ async function handleChat(e) {
     isProcessing = true;
     sendBtn.disabled = true;
 
+    // Bot message that is filled in as tokens arrive
+    const botMsg = addMessage('', 'bot');
+    const bubble = botMsg.querySelector('.msg-bubble');
+    const answerText = bubble.querySelector('p');
+
     try {
-        const response = await fetch('/chat', {
+        const response = await fetch('/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ question: question })
+            body: JSON.stringify({ question: question, session_id: sessionId })
         });
 
-        const data = await response.json();
+        if (!response.ok) {
+            const data = await response.json();
+            answerText.innerText = `Error: ${data.detail || 'Something went wrong'}`;
+            return;
+        }
 
-        if (response.ok) {
-            addMessage(data.answer, 'bot', data.sources);
-        } else {
-            addMessage(`Error: ${data.detail || 'Something went wrong'}`, 'bot');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let sources = [];
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const blocks = buffer.split('\n\n');
+            buffer = blocks.pop();
+
+            for (const block of blocks) {
+                if (!block.trim()) continue;
+                const { event, data } = parseEvent(block);
+
+                if (event === 'sources') {
+                    sources = data;
+                } else if (event === 'token') {
+                    answer += data;
+                    answerText.innerText = answer;
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                } else if (event === 'done') {
+                    bubble.insertAdjacentHTML('beforeend', sourcesHtml(sources));
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                } else if (event === 'error') {
+                    answerText.innerText = `Error: ${data.detail || 'Something went wrong'}`;
+                }
+            }
         }
     } catch (error) {
-        addMessage(`Connection error: ${error.message}`, 'bot');
+        answerText.innerText = `Connection error: ${error.message}`;
     } finally {
         isProcessing = false;
         sendBtn.disabled = false;